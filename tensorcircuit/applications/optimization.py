@@ -2,24 +2,65 @@
 modules for QUBO problems in QAOA
 """
 
-from typing import List, Callable, Any, Optional, Tuple
-from functools import partial
+from typing import List, Callable, Any, Optional, Sequence, Tuple
+from functools import lru_cache, partial
+import logging
 
+import numpy as np
 import tensorflow as tf
 import scipy.optimize as optimize
 
-from ..cons import backend
+from ..cons import backend, dtypestr, rdtypestr
 from ..quantum import measurement_results
 from ..interfaces import scipy_interface
 from ..templates.ansatz import QAOA_ansatz_for_Ising
-from ..templates.conversions import QUBO_to_Ising
+from ..templates.conversions import QUBO_to_Ising, get_z_indices
+from ..templates.measurements import sparse_expectation
+
+logger = logging.getLogger(__name__)
 
 Circuit = Any
 Tensor = Any
 Array = Any
 
+_tf_advisory_logged = False
+
+
+def Ising_hamiltonian(pauli_terms: Tensor, weights: List[float]) -> Tensor:
+    """
+    Construct the Ising Hamiltonian as a sparse matrix from the Pauli terms and weights.
+    The offset is ignored.
+
+    :param pauli_terms: A list of Pauli terms, where each term is represented as a list of 0/1 series.
+    :param weights: A list of weights corresponding to each Pauli term.
+    :return: The backend compatible sparse matrix of the Ising Hamiltonian.
+        All the 2^n diagonal entries are stored, even the zero ones, so that the sparse structure
+        only depends on the number of qubits and jitted functions are not retraced for new weights.
+    """
+    terms = np.asarray(pauli_terms, dtype=np.int8)
+    term_weights = np.asarray(weights)
+    all_binary = _all_bitstrings(terms.shape[1])
+    # Z terms are diagonal, each one contributes its weight times the parity sign of the state
+    diagonal = np.zeros(all_binary.shape[0])
+    for term, weight in zip(terms, term_weights):
+        parity = np.bitwise_xor.reduce(all_binary[:, term == 1], axis=1)
+        diagonal += weight * (1 - 2 * parity.astype(np.float64))
+    indices = np.arange(len(diagonal), dtype=np.int64)
+    return backend.coo_sparse_matrix(
+        indices=np.stack([indices, indices], axis=1),
+        values=diagonal.astype(dtypestr),
+        shape=(len(diagonal), len(diagonal)),
+    )
+
 
-def Ising_loss(c: Circuit, pauli_terms: Tensor, weights: List[float]) -> Any:
+def Ising_loss(
+    c: Circuit,
+    pauli_terms: Tensor,
+    weights: List[float],
+    z_indices: Optional[Sequence[Sequence[int]]] = None,
+    hamiltonian: Optional[Tensor] = None,
+    enable_lightcone: bool = False,
+) -> Any:
     """
     computes the loss function for the Ising model based on a given quantum circuit,
     a list of Pauli terms, and corresponding weights.
@@ -28,28 +69,36 @@ def Ising_loss(c: Circuit, pauli_terms: Tensor, weights: List[float]) -> Any:
     :param c: A quantum circuit object generating the state.
     :param pauli_terms: A list of Pauli terms, where each term is represented as a list of 0/1 series.
     :param weights: A list of weights corresponding to each Pauli term.
+    :param z_indices (optional): The Pauli-Z qubit indices of each term as returned by ``get_z_indices``.
+        Default is None, which derives them from ``pauli_terms``.
+        Precompute them once when the loss is evaluated repeatedly.
+    :param hamiltonian (optional): The sparse Ising Hamiltonian as returned by ``Ising_hamiltonian``.
+        Default is None. If provided, the loss is evaluated as a single sparse expectation
+        instead of one expectation per Pauli term.
+    :param enable_lightcone (optional): Whether to enable light cone simplification for the
+        per-term expectations. Default is False. Each local Z or ZZ term then only contracts the gates
+        in its causal cone, which is cheaper for shallow circuits on sparse problems,
+        at the price of a separate contraction (and a longer jit compilation) for every term.
+        It has no effect when ``hamiltonian`` is given.
     :return loss: A real number representing the computed loss value.
     """
-    loss = 0.0
-    for k in range(len(pauli_terms)):
-        term = pauli_terms[k]
-        index_of_ones = []
-
-        for l in range(len(term)):
-            if term[l] == 1:
-                index_of_ones.append(l)
-
-        # Compute expectation value based on the number of qubits involved in the Pauli term
-        if len(index_of_ones) == 1:
-            delta_loss = weights[k] * c.expectation_ps(z=[index_of_ones[0]])
-            # Compute expectation value for a single-qubit Pauli term
-        else:
-            delta_loss = weights[k] * c.expectation_ps(
-                z=[index_of_ones[0], index_of_ones[1]]
-            )
-            # Compute expectation value for a two-qubit Pauli term
-
-        loss += delta_loss
+    if hamiltonian is not None:
+        return sparse_expectation(c, hamiltonian)
+
+    if z_indices is None:
+        z_indices = get_z_indices(pauli_terms)
+
+    # Compute expectation value for each single-qubit or two-qubit Pauli term,
+    # the contraction of each term depends on its static qubit indices,
+    # while the weighted sum over terms is done as one vectorized reduction.
+    expectations = backend.stack(
+        [
+            c.expectation_ps(z=index_of_ones, enable_lightcone=enable_lightcone)
+            for index_of_ones in z_indices
+        ]
+    )
+    weights = backend.cast(backend.convert_to_tensor(weights), dtypestr)
+    loss = backend.sum(weights * expectations)
 
     return backend.real(loss)
 
@@ -61,6 +110,9 @@ def QAOA_loss(
     params: List[float],
     full_coupling: bool = False,
     mixer: str = "X",
+    z_indices: Optional[Sequence[Sequence[int]]] = None,
+    hamiltonian: Optional[Tensor] = None,
+    enable_lightcone: bool = False,
 ) -> Any:
     """
     computes the loss function for the Quantum Approximate Optimization Algorithm (QAOA) applied to the Ising model.
@@ -71,6 +123,10 @@ def QAOA_loss(
     :param params: A list of parameter values used in the QAOA ansatz.
     :param full_coupling (optional): A flag indicating whether to use all-to-all coupling in mixers. Default is False.
     :paran mixer (optional): The mixer operator to use. Default is "X". The other options are "XY" and "ZZ".
+    :param z_indices (optional): The precomputed Pauli-Z qubit indices of each term. Default is None.
+    :param hamiltonian (optional): The precomputed sparse Ising Hamiltonian. Default is None.
+    :param enable_lightcone (optional): Whether to enable light cone simplification
+        for the per-term expectations. Default is False.
     :return: The computed loss value.
     """
     c = QAOA_ansatz_for_Ising(
@@ -78,15 +134,148 @@ def QAOA_loss(
     )
     # Obtain the quantum circuit using QAOA_from_Ising function
 
-    return Ising_loss(c, pauli_terms, weights)
+    return Ising_loss(
+        c,
+        pauli_terms,
+        weights,
+        z_indices=z_indices,
+        hamiltonian=hamiltonian,
+        enable_lightcone=enable_lightcone,
+    )
     # Compute the Ising loss using Ising_loss function on the obtained circuit
 
 
+@lru_cache()
+def _QAOA_value_and_grad(
+    backend_name: str,
+    dtype: str,
+    pauli_terms: Tuple[Tuple[int, ...], ...],
+    nlayers: int,
+    mixer: str,
+    full_coupling: bool,
+    vvag: bool,
+) -> Callable[..., Any]:
+    """
+    Build the jitted loss and gradients function of ``QAOA_loss`` for ``QUBO_QAOA``.
+    The function is cached on the backend, the dtype and the problem structure,
+    so that the compilation is reused when the same kind of problem is solved repeatedly.
+
+    :param backend_name: The name of the backend the function is built for.
+    :param dtype: The complex dtype the function is built for.
+    :param pauli_terms: The Pauli terms as a tuple of 0/1 tuples.
+    :param nlayers: The number of layers in the QAOA ansatz.
+    :param mixer: The mixer operator to use.
+    :param full_coupling: A flag indicating whether to use all-to-all coupling in mixers.
+    :param vvag: A flag indicating whether to vectorize over a batch of parameters.
+    :return: The jitted function mapping ``(params, weights, hamiltonian)`` to the loss and gradients.
+    """
+
+    def loss(params: Tensor, weights: Tensor, hamiltonian: Tensor) -> Tensor:
+        return QAOA_loss(
+            nlayers,
+            pauli_terms,
+            weights,
+            params,
+            full_coupling=full_coupling,
+            mixer=mixer,
+            hamiltonian=hamiltonian,
+        )
+
+    if vvag is True:
+        return backend.jit(backend.vvag(loss, argnums=0, vectorized_argnums=0))
+        # Use vectorized variational adjoint gradient (vvag) to train multiple circuits at once.
+    return backend.jit(backend.value_and_grad(loss))
+
+
+@lru_cache()
+def _QAOA_train_step(
+    backend_name: str,
+    dtype: str,
+    pauli_terms: Tuple[Tuple[int, ...], ...],
+    nlayers: int,
+    mixer: str,
+    full_coupling: bool,
+    vvag: bool,
+    shape: Tuple[int, ...],
+) -> Tuple[Callable[..., Any], Callable[..., Any]]:
+    """
+    Build the jitted training step of ``QUBO_QAOA``, i.e. the loss and gradients
+    from ``_QAOA_value_and_grad`` followed by one Adam update.
+    The step is cached on the same keys and the shape of the parameters,
+    so that repeated problem solves neither rebuild the optimizer nor retrace the step.
+    Adam from optax is used on the jax backend and Adam from keras on the tensorflow backend.
+
+    :param backend_name: The name of the backend the step is built for.
+    :param dtype: The complex dtype the step is built for.
+    :param pauli_terms: The Pauli terms as a tuple of 0/1 tuples.
+    :param nlayers: The number of layers in the QAOA ansatz.
+    :param mixer: The mixer operator to use.
+    :param full_coupling: A flag indicating whether to use all-to-all coupling in mixers.
+    :param vvag: A flag indicating whether to vectorize over a batch of parameters.
+    :param shape: The shape of the parameters.
+    :return: The ``reset`` function mapping ``(params, learning_rate)`` to a fresh optimizer state,
+        and the jitted ``step`` function mapping ``(params, opt_state, weights, hamiltonian)``
+        to the loss, the updated parameters and the updated optimizer state.
+    """
+    loss_val_grad = _QAOA_value_and_grad(
+        backend_name, dtype, pauli_terms, nlayers, mixer, full_coupling, vvag
+    )
+
+    if backend_name == "jax":
+        import optax
+
+        # The Adam moments are kept in the optax state and updated together with
+        # the loss and gradients inside the jitted step, the learning rate is
+        # injected into the state so that it is not baked into the compiled step.
+        jax_opt = optax.inject_hyperparams(optax.adam)(learning_rate=1e-2)
+
+        def jax_reset(params: Tensor, learning_rate: float) -> Any:
+            opt_state = jax_opt.init(params)
+            lr = opt_state.hyperparams["learning_rate"]
+            opt_state.hyperparams["learning_rate"] = backend.convert_to_tensor(
+                np.asarray(learning_rate, dtype=lr.dtype)
+            )
+            return opt_state
+
+        @backend.jit
+        def jax_step(
+            params: Tensor, opt_state: Any, weights: Tensor, hamiltonian: Tensor
+        ) -> Tuple[Tensor, Tensor, Any]:
+            loss_val, grads = loss_val_grad(params, weights, hamiltonian)
+            updates, opt_state = jax_opt.update(grads, opt_state, params)
+            params = optax.apply_updates(params, updates)
+            return loss_val, params, opt_state
+
+        return jax_reset, jax_step
+
+    # The Adam moments live in the variables of a single keras optimizer,
+    # which are reset instead of rebuilt for every solve, so opt_state is None.
+    params_var = tf.Variable(tf.zeros(shape, dtype=rdtypestr))
+    opt = tf.keras.optimizers.Adam()
+    opt.build([params_var])
+
+    def reset(params: Tensor, learning_rate: float) -> None:
+        opt.learning_rate.assign(learning_rate)
+        for v in opt.variables:
+            v.assign(tf.zeros_like(v))
+
+    @backend.jit
+    def step(
+        params: Tensor, opt_state: None, weights: Tensor, hamiltonian: Tensor
+    ) -> Tuple[Tensor, Tensor, None]:
+        params_var.assign(params)
+        loss_val, grads = loss_val_grad(params_var.read_value(), weights, hamiltonian)
+        opt.apply_gradients([(grads, params_var)])
+        return loss_val, params_var.read_value(), opt_state
+
+    return reset, step
+
+
 def QUBO_QAOA(
     Q: Tensor,
     nlayers: int,
     iterations: int,
-    vvag: bool = False,
+    vvag: bool = True,
     ncircuits: int = 10,
     init_params: Optional[List[float]] = None,
     mixer: str = "X",
@@ -96,70 +285,160 @@ def QUBO_QAOA(
 ) -> Array:
     """
     Performs the QAOA on a given QUBO problem.
-    Adam optimizer from TensorFlow is used.
+    Adam optimizer from TensorFlow is used on the tensorflow backend,
+    and Adam optimizer from optax is used on the jax backend.
+    The training step is compiled once per kind of problem and reused by repeated solves.
+    The jax backend is usually faster.
 
     :param Q: The n-by-n square and symmetric Q-matrix representing the QUBO problem.
     :param nlayers: The number of layers (depth) in the QAOA ansatz.
     :param iterations: The number of iterations to run the optimization.
-    :param vvag (optional): A flag indicating whether to use vectorized variational adjoint gradient. Default is False.
+    :param vvag (optional): A flag indicating whether to use vectorized variational adjoint gradient. Default is True.
+        The ``ncircuits`` random initializations are then trained concurrently and the best one is returned.
+        Set it to False to train a single circuit, e.g. when vectorization brings little gain on the
+        tensorflow backend (the jax backend usually scales best with vectorization).
     :param ncircuits (optional): The number of circuits when using vectorized variational adjoint gradient.
         Default is 10.
     :param init_params (optional): The initial parameters for the ansatz circuit.
         Default is None, which initializes the parameters randomly.
+        With ``vvag``, parameters of shape [ncircuits, 2 * nlayers] are trained as a batch,
+        while one-dimensional parameters are trained as a single circuit.
     :paran mixer (optional): The mixer operator to use. Default is "X". The other options are "XY" and "ZZ".
     :param learning_rate (optional): The learning rate for the Adam optimizer. Default is 1e-2.
     :param callback (optional): A callback function that is executed during each iteration. Default is None.
+        With ``vvag``, it receives the losses and parameters of all the circuits.
     :param full_coupling (optional): A flag indicating whether to use all-to-all coupling in mixers. Default is False.
     :return params: The optimized parameters for the ansatz circuit.
+        With ``vvag``, the parameters of the circuit with the lowest final loss are returned.
     """
 
     pauli_terms, weights, _ = QUBO_to_Ising(Q)
-
-    loss_val_grad = backend.value_and_grad(
-        partial(
-            QAOA_loss,
-            nlayers,
-            pauli_terms,
-            weights,
-            mixer=mixer,
-            full_coupling=full_coupling,
-        )
-    )
-    loss_val_grad = backend.jit(loss_val_grad, static_argnums=(1, 2))
-    # Define the loss and gradients function using value_and_grad, which calculates both the loss value and gradients.
+    hamiltonian = Ising_hamiltonian(pauli_terms, weights)
+    # The Hamiltonian is fixed by the problem, so it is only constructed once
+    # and the loss is evaluated as a single sparse expectation.
 
     if init_params is None:
-        params = backend.implicit_randn(shape=[2 * nlayers], stddev=0.5)
         if vvag is True:
-            loss_val_grad = backend.vvag(loss_val_grad, argnums=0, vectorized_argnums=0)
             params = backend.implicit_randn(shape=[ncircuits, 2 * nlayers], stddev=0.1)
-            # If init_params is not provided, initialize the parameters randomly.
-            # If vvag flag is set to True, use vectorized variational adjoint gradient (vvag) with multiple circuits.
+        else:
+            params = backend.implicit_randn(shape=[2 * nlayers], stddev=0.5)
+        # If init_params is not provided, initialize the parameters randomly.
     else:
-        params = init_params
+        params = backend.convert_to_tensor(init_params)
         # If init_params is provided, use the provided parameters.
     # Initialize the parameters for the ansatz circuit.
 
-    # This can improve the performance by pre-compiling the loss and gradients function.
+    batched = vvag is True and len(backend.shape_tuple(params)) == 2
+    problem = (
+        backend.name,
+        dtypestr,
+        tuple(map(tuple, np.asarray(pauli_terms).tolist())),
+        nlayers,
+        mixer,
+        full_coupling,
+        batched,
+    )
+    loss_val_grad = _QAOA_value_and_grad(*problem)
+    # The jitted loss and gradients function only depends on the problem structure,
+    # so it is reused across calls, while the weights and the Hamiltonian are passed as arguments.
+    weights = backend.cast(backend.convert_to_tensor(weights), rdtypestr)
+
+    if backend.name in ["tensorflow", "jax"]:
+        if backend.name == "tensorflow":
+            global _tf_advisory_logged
+            if not _tf_advisory_logged:
+                logger.info(
+                    "QUBO_QAOA is running on the tensorflow backend, "
+                    "consider `tc.set_backend('jax')` for a faster training loop"
+                )
+                _tf_advisory_logged = True
+        # The whole training step, including the Adam update, is jitted and cached
+        # together with the optimizer, so that it is only traced once per kind of problem.
+        params = backend.cast(backend.convert_to_tensor(params), rdtypestr)
+        reset, train_step = _QAOA_train_step(
+            *problem, tuple(backend.shape_tuple(params))
+        )
+        opt_state = reset(params, learning_rate)
+
+        for _ in range(iterations):
+            loss_val, params, opt_state = train_step(
+                params, opt_state, weights, hamiltonian
+            )
+            if callback is not None:
+                callback(loss_val, params)
+            # Execute the callback function with the current loss and parameters.
+    else:
+        opt = backend.optimizer(tf.keras.optimizers.Adam(learning_rate))
+        # Define the optimizer (Adam optimizer) with the specified learning rate.
 
-    opt = backend.optimizer(tf.keras.optimizers.Adam(learning_rate))
-    # Define the optimizer (Adam optimizer) with the specified learning rate.
+        for _ in range(iterations):
+            loss_val, grads = loss_val_grad(params, weights, hamiltonian)
+            # Calculate the loss and gradients using the loss_val_grad function.
 
-    for _ in range(iterations):
-        loss, grads = loss_val_grad(params)
-        # Calculate the loss and gradients using the loss_val_grad_jit function.
+            params = opt.update(grads, params)
+            # Update the parameters using the optimizer and gradients.
 
-        params = opt.update(grads, params)
-        # Update the parameters using the optimizer and gradients.
+            if callback is not None:
+                callback(loss_val, params)
+            # Execute the callback function with the current loss and parameters.
 
-        if callback is not None:
-            callback(loss, params)
-        # Execute the callback function with the current loss and parameters.
+    if batched:
+        loss_val, _ = loss_val_grad(params, weights, hamiltonian)
+        params = params[backend.argmin(loss_val)]
+        # Pick the circuit with the lowest loss of the final parameters among the batch.
 
     return params
     # Return the optimized parameters for the ansatz circuit.
 
 
+@lru_cache(maxsize=4)
+def _all_bitstrings(n: int) -> Array:
+    """
+    Generate all the 2^n binary states as a 0/1 array of shape (2^n, n),
+    where the first qubit corresponds to the most significant bit.
+    The result is cached and read-only, as it only depends on ``n``.
+
+    :param n: The number of qubits.
+    :return: The uint8 array of all binary states in ascending order.
+    """
+    # unpack the big-endian bytes of each integer, keeping only the lowest n bits
+    a = np.arange(2**n, dtype=">u8")
+    all_binary = np.unpackbits(a.view(np.uint8).reshape(-1, 8), axis=1)[:, -n:]
+    all_binary.setflags(write=False)
+    return all_binary
+
+
+@lru_cache(maxsize=4)
+def _qubo_costs_from_bytes(Q_bytes: bytes, shape: Tuple[int, ...], dtype: str) -> Array:
+    """
+    Compute and cache the QUBO costs of all the binary states for ``_qubo_costs``.
+    The Q-matrix is passed by its raw bytes, shape and dtype so that it can be used as a cache key.
+
+    :param Q_bytes: The raw bytes of the C-contiguous Q-matrix.
+    :param shape: The shape of the Q-matrix.
+    :param dtype: The dtype string of the Q-matrix.
+    :return: The read-only cost values of all binary states in ascending order of states.
+    """
+    Q = np.frombuffer(Q_bytes, dtype=dtype).reshape(shape)
+    all_binary = _all_bitstrings(shape[0])
+    costs = (all_binary.astype(Q.dtype) @ Q * all_binary).sum(axis=1)
+    costs.setflags(write=False)
+    return costs
+
+
+def _qubo_costs(Q: Tensor) -> Array:
+    """
+    Compute the QUBO cost :math:`x^TQx` of all the 2^n binary states.
+    The states are stored as uint8 and only cast to the dtype of ``Q`` for the matrix product.
+    The costs are cached by the content of ``Q``, so repeated calls with the same problem are free.
+
+    :param Q: The n-by-n square and symmetric Q-matrix.
+    :return: The read-only cost values of all binary states in ascending order of states.
+    """
+    Q = np.ascontiguousarray(Q)
+    return _qubo_costs_from_bytes(Q.tobytes(), Q.shape, Q.dtype.str)
+
+
 def cvar_value(r: List[float], p: List[float], percent: float) -> Any:
     """
     Compute the Conditional Value at Risk (CVaR) based on the measurement results.
@@ -214,18 +493,10 @@ def cvar_from_circuit(circuit: Circuit, nsamples: int, Q: Tensor, alpha: float)
 
     # Determine the number of qubits in the circuit and generate all possible states
     n_qubits = len(Q)
-    all_states = tf.constant([format(i, f"0{n_qubits}b") for i in range(2**n_qubits)])
-    all_binary = tf.reshape(
-        tf.strings.to_number(tf.strings.bytes_split(all_states), tf.float32),
-        (2**n_qubits, n_qubits),
-    )
     all_decimal = tf.range(2**n_qubits, dtype=tf.int32)
 
-    # Convert the Q matrix to a TensorFlow tensor
-    Q_tensor = tf.convert_to_tensor(Q, dtype=tf.float32)
-
     # calculate cost values
-    values = tf.reduce_sum(all_binary * tf.matmul(all_binary, Q_tensor), axis=1)
+    values = tf.constant(_qubo_costs(Q), dtype=tf.float32)
 
     # Count the occurrences of each state and calculate probabilities
     state_counts = tf.reduce_sum(
@@ -254,22 +525,8 @@ def cvar_from_expectation(circuit: Circuit, Q: Tensor, alpha: float) -> Any:
     # Calculate the probability amplitudes for quantum circuit outcomes.
     prob = tf.convert_to_tensor(circuit.probability(), dtype=tf.float32)
 
-    # Generate all possible binary states for the given Q-matrix.
-    n_qubits = len(Q)
-    all_states = tf.constant(
-        [format(i, "0" + str(n_qubits) + "b") for i in range(2 ** len(Q))]
-    )
-    all_binary = tf.reshape(
-        tf.strings.to_number(tf.strings.bytes_split(all_states), tf.float32),
-        (2**n_qubits, n_qubits),
-    )
-
-    # Convert the Q-matrix to a TensorFlow tensor.
-    Q_tensor = tf.convert_to_tensor(Q, dtype=tf.float32)
-
-    # calculate cost values
-    elementwise_product = tf.multiply(all_binary, tf.matmul(all_binary, Q_tensor))
-    values = tf.reduce_sum(elementwise_product, axis=1)
+    # calculate cost values of all possible binary states for the given Q-matrix.
+    values = tf.constant(_qubo_costs(Q), dtype=tf.float32)
 
     # Calculate the CVaR value using the computed values and the probability distribution.
     cvar_result = cvar_value(values, prob, alpha)
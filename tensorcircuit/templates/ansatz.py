@@ -5,6 +5,7 @@ Shortcuts for reusable circuit ansatz
 from typing import Any, List
 
 from ..circuit import Circuit as Circ
+from .conversions import get_z_indices
 
 Tensor = Any
 Circuit = Any
@@ -31,17 +32,14 @@ def QAOA_ansatz_for_Ising(
     :return: QAOA ansatz for Ising model.
     """
     nqubits = len(pauli_terms[0])
+    z_indices = get_z_indices(pauli_terms)
     c: Any = Circ(nqubits)
     for i in range(nqubits):
         c.h(i)  # Apply Hadamard gate to each qubit
 
     for j in range(nlayers):
         # cost terms
-        for k, term in enumerate(pauli_terms):
-            index_of_ones = []
-            for l in range(len(term)):
-                if term[l] == 1:
-                    index_of_ones.append(l)
+        for k, index_of_ones in enumerate(z_indices):
             if len(index_of_ones) == 1:
                 c.rz(index_of_ones[0], theta=2 * weights[k] * params[2 * j])
                 # Apply Rz gate with angle determined by weight and current parameter value
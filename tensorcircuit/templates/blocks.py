@@ -12,7 +12,7 @@ import numpy as np
 from .graphs import Grid2DCoord
 from .. import gates as G
 from ..circuit import Circuit as Circ
-from ..cons import backend
+from ..cons import backend, dtypestr
 
 Circuit = Any  # we don't use the real circuit class as too many mypy complains emerge
 Tensor = Any
@@ -70,42 +70,103 @@ def Bell_pair_block(
 def Grid2D_entangling(
     c: Circuit, coord: Grid2DCoord, unitary: Tensor, params: Tensor, **kws: Any
 ) -> Circuit:
-    i = 0
-    for a, b in coord.all_rows():
-        c.exp1(a, b, unitary=unitary, theta=params[i], **kws)
-        i += 1
-    for a, b in coord.all_cols():
+    r"""
+    Apply ``exp1`` gates with the same ``unitary`` on all the bonds of a 2D grid,
+    first the row bonds and then the column bonds, each with its own parameter.
+
+    .. note::
+
+        The bonds are applied in order since a general ``unitary`` needs not commute on overlapping bonds.
+
+    :param c: Circuit in
+    :type c: Circuit
+    :param coord: The 2D grid coordinate
+    :type coord: Grid2DCoord
+    :param unitary: The unitary :math:`U` with :math:`U^2=I` for :math:`e^{-i\theta U}`
+    :type unitary: Tensor
+    :param params: The parameters, one for each bond in the order of rows and then columns
+    :type params: Tensor
+    :return: Circuit out
+    :rtype: Circuit
+    """
+    bonds = list(coord.all_rows()) + list(coord.all_cols())
+    for i, (a, b) in enumerate(bonds):
         c.exp1(a, b, unitary=unitary, theta=params[i], **kws)
-        i += 1
     return c
 
 
+def QAOA_zz_diagonal(g: Graph, n: int) -> Tensor:
+    r"""
+    The diagonal of the QAOA cost Hamiltonian :math:`\sum_{(i,j)\in g} w_{ij} Z_iZ_j`
+    in the computational basis, to be used as ``zz_diagonal`` in :py:meth:`QAOA_block`.
+
+    :param g: The graph whose edges (with optional ``weight``) define the ZZ terms
+    :type g: Graph
+    :param n: The number of qubits
+    :type n: int
+    :return: The real diagonal of shape [2**n]
+    :rtype: Tensor
+    """
+    basis = np.arange(2**n)
+    diag = np.zeros([2**n])
+    for e1, e2 in g.edges:
+        # Z_iZ_j is -1 where the two bits differ, qubit 0 being the most significant bit
+        parity = ((basis >> (n - 1 - e1)) ^ (basis >> (n - 1 - e2))) & 1
+        diag += g[e1][e2].get("weight", 1.0) * (1 - 2 * parity)
+    return diag
+
+
 def QAOA_block(
-    c: Circuit, g: Graph, paramzz: Tensor, paramx: Tensor, **kws: Any
+    c: Circuit,
+    g: Graph,
+    paramzz: Tensor,
+    paramx: Tensor,
+    zz_diagonal: Optional[Tensor] = None,
+    **kws: Any
 ) -> Circuit:
-    if backend.sizen(paramzz) == 1:
-        for e1, e2 in g.edges:
-            c.exp1(
-                e1,
-                e2,
-                unitary=G._zz_matrix,
-                theta=paramzz * g[e1][e2].get("weight", 1.0),
-                **kws
-            )
+    r"""
+    One QAOA layer: :math:`e^{-i\theta Z_iZ_j}` gates on the edges of ``g`` followed by rx gates on the nodes.
+    A single ``paramzz`` is scaled by the edge weights, otherwise one parameter per edge is expected,
+    and similarly for ``paramx`` on the nodes.
+
+    :param c: Circuit in
+    :type c: Circuit
+    :param g: The graph defining the ZZ terms
+    :type g: Graph
+    :param paramzz: The parameter(s) for the ZZ rotations
+    :type paramzz: Tensor
+    :param paramx: The parameter(s) for the rx rotations
+    :type paramx: Tensor
+    :param zz_diagonal: The precomputed cost diagonal from :py:meth:`QAOA_zz_diagonal`, defaults to None.
+        If given (with a single ``paramzz`` on a statevector ``Circuit``), the commuting ZZ layer is applied
+        as one elementwise phase on the state instead of one gate per edge. A new circuit is then
+        created with the phased state as inputs, so that the previous gates are not kept in its record.
+    :type zz_diagonal: Optional[Tensor], optional
+    :return: Circuit out
+    :rtype: Circuit
+    """
+    if zz_diagonal is not None and isinstance(c, Circ) and backend.sizen(paramzz) == 1:
+        theta = backend.cast(backend.reshape(paramzz, []), dtypestr)
+        diag = backend.cast(backend.convert_to_tensor(zz_diagonal), dtypestr)
+        phases = backend.exp(-1.0j * theta * diag)
+        c = Circ(c._nqubits, inputs=c.state() * phases)
     else:
-        i = 0
-        for e1, e2 in g.edges:
+        # promote a shared parameter to one parameter per edge, scaled by the edge weights,
+        # so that the gates are applied in a single loop
+        paramzz = backend.reshape(paramzz, [-1])
+        if backend.sizen(paramzz) == 1:
+            weights = np.array([g[e1][e2].get("weight", 1.0) for e1, e2 in g.edges])
+            paramzz = backend.tile(paramzz, [len(weights)]) * backend.cast(
+                weights, backend.dtype(paramzz)
+            )
+        for i, (e1, e2) in enumerate(g.edges):
             c.exp1(e1, e2, unitary=G._zz_matrix, theta=paramzz[i], **kws)
-            i += 1
 
+    paramx = backend.reshape(paramx, [-1])
     if backend.sizen(paramx) == 1:
-        for n in g.nodes:
-            c.rx(n, theta=paramx)
-    else:
-        i = 0
-        for n in g.nodes:
-            c.rx(n, theta=paramx[i])
-            i += 1
+        paramx = backend.tile(paramx, [len(g.nodes)])
+    for i, n in enumerate(g.nodes):
+        c.rx(n, theta=paramx[i])
     return c
 
 
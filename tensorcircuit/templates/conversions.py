@@ -24,71 +24,68 @@ def get_ps(qo: Any, n: int) -> Tuple[Tensor, Tensor]:
     """
     value = {"X": 1, "Y": 2, "Z": 3}
     terms = qo.terms
-    res = []
+    # fill a preallocated array row by row instead of growing tuples/arrays per term
+    res = np.zeros([len(terms), n], dtype=int)
     wts = []
-    for key in terms:
-        bit = np.zeros(n, dtype=int)
-        for i in range(len(key)):
-            bit[key[i][0]] = value[key[i][1]]
-        w = terms[key]
-        res_t = tuple()  # type: ignore
-        for i in range(n):
-            res_t = res_t + (bit[i],)
-        res.append(res_t)
-        wts.append(w)
-    return np.array(res), np.array(wts)
-
-
-def QUBO_to_Ising(Q: Tensor) -> Tuple[Tensor, List[float], float]:
+    for k, key in enumerate(terms):
+        for i, p in key:
+            res[k, i] = value[p]
+        wts.append(terms[key])
+    return res, np.array(wts)
+
+
+def QUBO_to_Ising(Q: Tensor) -> Tuple[Tensor, Tensor, float]:
     """
     Cnvert the Q matrix into a the indication of pauli terms, the corresponding weights, and the offset.
     The outputs are used to construct an Ising Hamiltonian for QAOA.
 
     :param Q: The n-by-n square and symmetric Q-matrix.
-    :return pauli_terms: A list of 0/1 series, where each element represents a Pauli term.
+    :return pauli_terms: An int8 array of shape (n_terms, n) with 0/1 series, where each row represents a Pauli term.
     A value of 1 indicates the presence of a Pauli-Z operator, while a value of 0 indicates its absence.
-    :return weights: A list of weights corresponding to each Pauli term.
+    :return weights: An array of weights corresponding to each Pauli term.
     :return offset: A float representing the offset term of the Ising Hamiltonian.
     """
 
     # input is n-by-n symmetric numpy array corresponding to Q-matrix
     # output is the components of Ising Hamiltonian
 
-    n = Q.shape[0]
+    Q = np.ascontiguousarray(Q, dtype=np.float64)
 
     # square matrix check
-    if Q[0].shape[0] != n:
+    if Q.ndim != 2 or Q.shape[0] != Q.shape[1]:
         raise ValueError("Matrix is not a square matrix.")
+    n = Q.shape[0]
 
-    offset = (
-        np.triu(Q, 0).sum() / 2
-    )  # Calculate the offset term of the Ising Hamiltonian
-    pauli_terms = []  # List to store the Pauli terms
-    weights = (
-        -np.sum(Q, axis=1) / 2
-    )  # Calculate the weights corresponding to each Pauli term
-
-    for i in range(n):
-        term = np.zeros(n)
-        term[i] = 1
-        pauli_terms.append(
-            term.tolist()
-        )  # Add a Pauli term corresponding to a single qubit
-
-    for i in range(n - 1):
-        for j in range(i + 1, n):
-            term = np.zeros(n)
-            term[i] = 1
-            term[j] = 1
-            pauli_terms.append(
-                term.tolist()
-            )  # Add a Pauli term corresponding to a two-qubit interaction
-
-            weight = (
-                Q[i][j] / 2
-            )  # Calculate the weight for the two-qubit interaction term
-            weights = np.concatenate(
-                (weights, weight), axis=None
-            )  # Add the weight to the weights list
+    # Calculate the offset term of the Ising Hamiltonian,
+    # for symmetric Q two reductions give np.triu(Q, 0).sum() / 2 without materializing triu
+    if np.allclose(Q, Q.T):
+        offset = (np.trace(Q) + Q.sum()) / 4
+    else:
+        offset = np.triu(Q, 0).sum() / 2
+
+    # single-qubit terms Z_i, one per row of the identity
+    singles = np.eye(n, dtype=np.int8)
+    # two-qubit terms Z_iZ_j for all i < j, scattered into a preallocated block
+    iu, ju = np.triu_indices(n, k=1)
+    pairs = np.zeros((iu.size, n), dtype=np.int8)
+    rows = np.arange(iu.size)
+    pairs[rows, iu] = 1
+    pairs[rows, ju] = 1
+    pauli_terms = np.concatenate([singles, pairs], axis=0)
+
+    # weights for the single-qubit terms followed by the two-qubit interaction terms
+    weights = np.concatenate([-np.sum(Q, axis=1) / 2, Q[iu, ju] / 2])
 
     return pauli_terms, weights, offset
+
+
+def get_z_indices(pauli_terms: Tensor) -> List[List[int]]:
+    """
+    Get the qubit indices of the Pauli-Z operators for each 0/1 Pauli term returned by ``QUBO_to_Ising``.
+    The indices only depend on the problem structure, so they can be computed once
+    and reused for every evaluation of the loss function.
+
+    :param pauli_terms: A list of 0/1 series, where each element represents a Pauli term.
+    :return z_indices: A list of qubit index lists, one for each Pauli term.
+    """
+    return [np.flatnonzero(term).tolist() for term in np.asarray(pauli_terms)]
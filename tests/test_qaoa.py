@@ -8,12 +8,23 @@ sys.path.insert(0, modulepath)
 
 import numpy as np
 import pytest
+from pytest_lazyfixture import lazy_fixture as lf
 
 from tensorcircuit.applications.dqas import set_op_pool
 from tensorcircuit.applications.graphdata import get_graph
 from tensorcircuit.applications.layers import Hlayer, rxlayer, zzlayer
 from tensorcircuit.applications.vags import evaluate_vag
+from tensorcircuit.applications.optimization import (
+    Ising_loss,
+    Ising_hamiltonian,
+    QUBO_QAOA,
+    _all_bitstrings,
+    _qubo_costs,
+    cvar_from_circuit,
+    cvar_loss,
+)
 from tensorcircuit.templates.ansatz import QAOA_ansatz_for_Ising
+from tensorcircuit.templates.conversions import QUBO_to_Ising, get_z_indices
 from tensorcircuit.circuit import Circuit
 
 
@@ -49,6 +60,11 @@ def example_inputs():
     return params, nlayers, pauli_terms, weights
 
 
+@pytest.fixture
+def qubo_matrix():
+    return np.array([[-5.0, -2.0, 1.0], [-2.0, 6.0, 0.5], [1.0, 0.5, -1.0]])
+
+
 @pytest.mark.parametrize("mixer, full_coupling", cases)
 def test_QAOA_ansatz_for_Ising(example_inputs, full_coupling, mixer):
     params, nlayers, pauli_terms, weights = example_inputs
@@ -84,3 +100,124 @@ def test_QAOA_ansatz_errors(example_inputs, full_coupling, mixer):
         QAOA_ansatz_for_Ising(
             params, nlayers, pauli_terms, weights, full_coupling, mixer
         )
+
+
+def test_Ising_loss(tfb, qubo_matrix):
+    Q = qubo_matrix
+    pauli_terms, weights, offset = QUBO_to_Ising(Q)
+    c = QAOA_ansatz_for_Ising([0.1, 0.2, 0.3, 0.4], 2, pauli_terms, weights)
+    loss = Ising_loss(c, pauli_terms, weights)
+    loss_indices = Ising_loss(
+        c, pauli_terms, weights, z_indices=get_z_indices(pauli_terms)
+    )
+    np.testing.assert_allclose(loss, loss_indices, atol=1e-5)
+    loss_sparse = Ising_loss(
+        c, pauli_terms, weights, hamiltonian=Ising_hamiltonian(pauli_terms, weights)
+    )
+    np.testing.assert_allclose(loss, loss_sparse, atol=1e-5)
+    loss_lightcone = Ising_loss(c, pauli_terms, weights, enable_lightcone=True)
+    np.testing.assert_allclose(loss, loss_lightcone, atol=1e-5)
+
+    # <H> + offset equals the QUBO cost averaged over the output distribution
+    probs = c.probability().numpy()
+    xs = np.array([[int(b) for b in f"{i:03b}"] for i in range(8)])
+    costs = np.einsum("bi,ij,bj->b", xs, Q, xs)
+    np.testing.assert_allclose(loss + offset, probs @ costs, atol=1e-4)
+
+
+@pytest.mark.parametrize("backend", [lf("tfb"), lf("jaxb")])
+@pytest.mark.parametrize("vvag", [True, False])
+def test_QUBO_QAOA(backend, vvag, qubo_matrix):
+    Q = qubo_matrix
+    losses = []
+    params = QUBO_QAOA(
+        Q,
+        2,
+        30,
+        vvag=vvag,
+        ncircuits=4,
+        learning_rate=5e-2,
+        callback=lambda l, p: losses.append(np.asarray(l)),
+    )
+    assert params.shape == (4,)
+    assert len(losses) == 30
+    if vvag:
+        assert losses[0].shape == (4,)
+    assert np.min(losses[-1]) < np.min(losses[0])
+
+
+def test_QUBO_QAOA_best_circuit(tfb, qubo_matrix):
+    Q = qubo_matrix
+    pauli_terms, weights, _ = QUBO_to_Ising(Q)
+    init_params = np.random.uniform(size=[4, 4]).astype(np.float32)
+    # without training, the initial circuit with the lowest loss is picked
+    params = QUBO_QAOA(Q, 2, 0, init_params=init_params)
+    losses = [
+        Ising_loss(
+            QAOA_ansatz_for_Ising(p, 2, pauli_terms, weights), pauli_terms, weights
+        )
+        for p in init_params
+    ]
+    np.testing.assert_allclose(params, init_params[np.argmin(losses)])
+
+
+@pytest.mark.parametrize("backend", [lf("tfb"), lf("jaxb")])
+def test_QUBO_QAOA_cache(backend, monkeypatch):
+    from tensorcircuit.applications import optimization
+
+    ntraces = [0]
+    _QAOA_value_and_grad = optimization._QAOA_value_and_grad
+
+    def counted_QAOA_value_and_grad(*args):
+        f = _QAOA_value_and_grad(*args)
+
+        def counted_f(*fargs):
+            # only called when the training step is traced
+            ntraces[0] += 1
+            return f(*fargs)
+
+        return counted_f
+
+    monkeypatch.setattr(
+        optimization, "_QAOA_value_and_grad", counted_QAOA_value_and_grad
+    )
+    optimization._QAOA_train_step.cache_clear()
+    Q1 = np.array([[-5.0, -2.0], [-2.0, 6.0]])
+    Q2 = np.array([[1.0, 3.0], [3.0, -2.0]])
+    QUBO_QAOA(Q1, 1, 2, vvag=False)
+    assert ntraces[0] == 1
+    # another problem of the same structure reuses the traced training step
+    QUBO_QAOA(Q2, 1, 2, vvag=False, learning_rate=0.1)
+    assert ntraces[0] == 1
+    optimization._QAOA_train_step.cache_clear()
+
+
+def test_qubo_costs(qubo_matrix):
+    Q = qubo_matrix
+    X = _all_bitstrings(3)
+    np.testing.assert_array_equal(X[5], [1, 0, 1])
+    np.testing.assert_allclose(_qubo_costs(Q), np.einsum("bi,ij,bj->b", X, Q, X))
+
+
+def test_cvar(tfb, qubo_matrix):
+    Q = qubo_matrix
+    X = _all_bitstrings(3).astype(np.float64)
+    costs = np.einsum("bi,ij,bj->b", X, Q, X)
+    params = np.array([0.3, 0.7, 0.2, 0.4])
+    alpha = 0.6
+    pauli_terms, weights, _ = QUBO_to_Ising(Q)
+    p = np.asarray(QAOA_ansatz_for_Ising(params, 2, pauli_terms, weights).probability())
+    order = np.argsort(costs)
+    p_sorted, r_sorted = p[order], costs[order]
+    # the lowest alpha fraction of the probability mass, the last state partially
+    mass = np.clip(alpha - (np.cumsum(p_sorted) - p_sorted), 0, p_sorted)
+    cvar = np.sum(mass * r_sorted) / alpha
+    np.testing.assert_allclose(
+        cvar_loss(2, Q, 100, alpha, True, params), cvar, rtol=1e-5
+    )
+
+    c = Circuit(3)
+    c.x(0)
+    c.x(2)
+    # a basis state gives the same outcome in every sample
+    np.testing.assert_allclose(cvar_from_circuit(c, 100, Q, alpha), costs[5], rtol=1e-5)
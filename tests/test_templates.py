@@ -107,6 +107,65 @@ def test_qaoa_template(backend):
     np.testing.assert_allclose(gr[1].shape, [6])
 
 
+@pytest.mark.parametrize("backend", [lf("tfb"), lf("jaxb")])
+def test_qaoa_template_paramx(backend):
+    import networkx as nx
+
+    g = nx.path_graph(4)
+
+    def reference(paramx):
+        c = tc.Circuit(4)
+        for i in range(4):
+            c.H(i)
+        for e1, e2 in g.edges:
+            c.exp1(e1, e2, unitary=tc.gates._zz_matrix, theta=0.3)
+        for i in range(4):
+            c.rx(i, theta=paramx[i])
+        return c.state()
+
+    def block(paramx):
+        c = tc.Circuit(4)
+        for i in range(4):
+            c.H(i)
+        c = tc.templates.blocks.QAOA_block(
+            c, g, tc.backend.convert_to_tensor(np.array([0.3])), paramx
+        )
+        return c.state()
+
+    # a single paramx is shared by all the nodes
+    paramx = tc.backend.convert_to_tensor(np.array([0.7]))
+    np.testing.assert_allclose(block(paramx), reference([0.7] * 4), atol=1e-5)
+    # one paramx per node is applied node by node
+    paramx = tc.backend.convert_to_tensor(np.array([0.1, 0.4, 0.9, 1.3]))
+    np.testing.assert_allclose(
+        block(paramx), reference([0.1, 0.4, 0.9, 1.3]), atol=1e-5
+    )
+
+
+@pytest.mark.parametrize("backend", [lf("tfb"), lf("jaxb")])
+def test_qaoa_template_diagonal(backend):
+    cd = tc.templates.graphs.Grid2DCoord(3, 2)
+    g = cd.lattice_graph(pbc=False)
+    for e1, e2 in g.edges:
+        g[e1][e2]["weight"] = np.random.uniform()
+    zz_diagonal = tc.templates.blocks.QAOA_zz_diagonal(g, 6)
+
+    def forward(paramzz, paramx, diagonal):
+        c = tc.Circuit(6)
+        for i in range(6):
+            c.H(i)
+        c = tc.templates.blocks.QAOA_block(
+            c, g, paramzz, paramx, zz_diagonal=zz_diagonal if diagonal else None
+        )
+        return c.state()
+
+    paramzz = tc.backend.real(0.3 * tc.backend.ones([1]))
+    paramx = tc.backend.real(0.7 * tc.backend.ones([1]))
+    np.testing.assert_allclose(
+        forward(paramzz, paramx, True), forward(paramzz, paramx, False), atol=1e-5
+    )
+
+
 def test_state_wrapper():
     Bell_pair_block_state = tc.templates.blocks.state_centric(
         tc.templates.blocks.Bell_pair_block
@@ -196,16 +255,32 @@ def test_QUBO_to_Ising(symmetric_matrix):
     expected_num_terms = n + n * (n - 1) // 2
     assert len(pauli_terms) == expected_num_terms
     assert len(weights) == expected_num_terms
-    assert isinstance(pauli_terms, list)
+    assert isinstance(pauli_terms, np.ndarray)
     assert isinstance(weights, np.ndarray)
     assert isinstance(offset, float)
-    assert pauli_terms == [
-        [1, 0],
-        [0, 1],
-        [1, 1],
-    ]
+    np.testing.assert_array_equal(
+        pauli_terms,
+        [
+            [1, 0],
+            [0, 1],
+            [1, 1],
+        ],
+    )
     assert all(weights == np.array([3.5, -2.0, -1.0]))
     assert offset == -0.5
 
     with pytest.raises(ValueError):
         tc.templates.conversions.QUBO_to_Ising(matrix2)
+    with pytest.raises(ValueError):
+        tc.templates.conversions.QUBO_to_Ising(np.ones(3))
+    # the offset of a non-symmetric matrix only counts its upper triangle
+    _, _, offset = tc.templates.conversions.QUBO_to_Ising(
+        np.array([[1.0, 2.0], [0.0, 3.0]])
+    )
+    assert offset == 3.0
+
+
+def test_get_z_indices():
+    pauli_terms = [[1, 0, 0], [0, 0, 1], [1, 0, 1]]
+    z_indices = tc.templates.conversions.get_z_indices(pauli_terms)
+    assert z_indices == [[0], [2], [0, 2]]